@@ -6,16 +6,25 @@
 # TODO: Documentation
 # TODO: macOS alias
 
+"""Fully parses the .DS_Store files generated by macOS.
+
+.DS_Store files contain records of the different properties (fields) of the
+files or directories of the directory of .DS_Store.  This module parses,
+displays, and explains all the fields currently known in .DS_Store.
+
+Usage: python3 parse.py <.DS_Store file>
+
+See README.md for more about .DS_Stores.
+"""
+
+import codecs
 import datetime
 import plistlib
+import struct
 import sys
 import warnings
 
 
-with open('README.md') as readme:
-    __doc__ = readme.read()
-
-
 # The Python types used for the different .DS_Store types:
 # 'bool': bool
 # 'shor': int
@@ -27,48 +36,90 @@ with open('README.md') as readme:
 # 'ustr': str
 
 
+# Big-endian unsigned integers, precompiled since they are decoded a lot
+_UINT16 = struct.Struct('>H')
+_UINT32 = struct.Struct('>I')
+_UINT64 = struct.Struct('>Q')
+# Two uint32s, e.g. x and y coordinates
+_UINT32_PAIR = struct.Struct('>2I')
+# Four uint16s, e.g. a window rectangle
+_UINT16_QUAD = struct.Struct('>4H')
+
+# The UTF-16BE decoder itself, skipping the codec lookup of bytes.decode
+# Takes the data, the error handler, and whether the data is final
+_decode_utf16be = codecs.utf_16_be_decode
+
+# Decoded 4-byte tags (field names, data types, etc.) by their raw bytes
+# Only a few distinct tags exist but each appears many times in a .DS_Store
+_TAGS = {}
+
+
+# Dates are in seconds since 1904
+_HFS_EPOCH = datetime.datetime(1904, 1, 1)
+
+
 def show_date(timestamp):
-    date = (datetime.datetime.fromtimestamp(timestamp)
-            - datetime.datetime.fromtimestamp(0)
-            + datetime.datetime(1904, 1, 1))
+    date = _HFS_EPOCH + datetime.timedelta(seconds=timestamp)
     return date.strftime('%B %-d, %Y at %-I:%M %p')
 
 
+def show_hex(data):
+    return f'0x{data.hex()}'
+
+
+def is_plist(data):
+    return data.startswith(b'bplist') and data[6:8].isdigit()
+
+
+def is_ds_store(data):
+    return data.startswith(b'Bud1')
+
+
 def show_bytes(data):
-    if data.startswith(b'bplist') and data[6:8].isdecimal():
-        return show(plistlib.loads(data))
+    if is_plist(data):
+        yield from show(plistlib.loads(data))
     elif data.startswith(b'book'):
         # TODO
-        return f'(in macOS alias type, unparsed) {data!r}'
-    elif data.startswith(b'Bud1'):
-        return show('\n'.join(DSStore(b'\x00\x00\x00\x01'
-                                      + data).human_readable()))
+        yield f'(in macOS alias type, unparsed) {data!r}'
+    elif is_ds_store(data):
+        # Nested .DS_Store, without the alignment int
+        yield from DSStore(b'\x00\x00\x00\x01' + data).human_readable()
     else:
-        return f'0x{data.hex()}'
+        yield show_hex(data)
 
 
 def is_inline(data):
+    if isinstance(data, bytes):
+        return not (is_plist(data) or is_ds_store(data))
     return not isinstance(data, (dict, tuple, list))
 
 
+# Indentation for the common tab depths
+_TABS = tuple('\t' * tab_depth for tab_depth in range(64))
+
+
 def show(data, tab_depth=0):
-    tabs = '\t' * tab_depth
+    if tab_depth < len(_TABS):
+        tabs = _TABS[tab_depth]
+    else:
+        tabs = '\t' * tab_depth
     if isinstance(data, dict):
         for key, value in data.items():
             if is_inline(value):
                 yield f'{tabs}{key}: {show_one(value)}'
             else:
                 yield f'{tabs}{key}:'
-                yield from show(value, tab_depth=tab_depth + 1)
+                yield from show(value, tab_depth + 1)
     elif isinstance(data, (tuple, list)):
         for value in data:
             if is_inline(value):
                 yield f'{tabs}- {show_one(value)}'
             else:
                 yield f'{tabs}-'
-                yield from show(value, tab_depth=tab_depth + 1)
+                yield from show(value, tab_depth + 1)
     elif isinstance(data, bytes):
-        yield f'{tabs}{show_bytes(data)}'
+        for line in show_bytes(data):
+            yield f'{tabs}{line}'
     elif isinstance(data, (bool, int, str)):
         yield f'{tabs}{data!s}'
     else:
@@ -79,14 +130,25 @@ def show_one(data):
     return next(show(data))
 
 
+def show_titled(title, data):
+    if is_inline(data):
+        yield f'{title}: {show_one(data)}'
+    else:
+        yield f'{title}:'
+        yield from show(data, 1)
+
+
 class Record:
 
-    def __init__(self, name, *args, **kwargs):
+    def __init__(self, name, fields=None):
         self.name = name
-        self.fields = dict(*args, **kwargs)
+        # fields is used as is, not copied
+        self.fields = fields if fields is not None else {}
+        # Parsed plists by field, as (raw data, parsed plist)
+        self._plists = {}
 
-    def update(self, *args, **kwargs):
-        self.fields.update(*args, **kwargs)
+    def update(self, fields):
+        self.fields.update(fields)
 
     def __repr__(self):
         kwargs = "".join(f", {key}={value!r}"
@@ -100,250 +162,343 @@ class Record:
             warnings.warn(f'{self} {field} {show_one(data)} not of length'
                           f' {" or ".join(acceptable_lengths)}')
 
+    def load_plist(self, field, data):
+        # Plists are only parsed when displayed, and then only once
+        cached = self._plists.get(field)
+        if cached is not None and cached[0] is data:
+            return cached[1]
+        plist = plistlib.loads(data)
+        self._plists[field] = (data, plist)
+        return plist
+
     def human_readable(self):
         # TODO: interpret the parsed plists
         for field, data in self.fields.items():
-            if field == 'BKGD':
-                # BKGD supplanted by TODO in later versions
-                self.validate_type(field, data, bytes, 12)
-                background_type = data[:4].decode('ascii')
-                if background_type == 'DefB':
-                    yield 'Background: Default'
-                elif background_type == 'ClrB':
-                    hex_color = data[4:10].hex()
-                    yield f'Background: Color #{hex_color}'
-                elif background_type == 'PctB':
-                    yield f'Background: Picture, see "Picture" field'
-                else:
-                    warnings.warn('Unrecognized background type'
-                                  f' {background_type}')
-                    yield f'Background (unrecognized): {show_one(data)}'
-            elif field == 'GRP0':
-                self.validate_type(field, data, str)
-                yield f'{field} (unknown): {data}'
-            elif field == 'ICVO':
-                self.validate_type(field, data, bool)
-                yield f'{field} (unknown): {data}'
-            elif field == 'Iloc':
-                self.validate_type(field, data, bytes, 16)
-                x = int.from_bytes(data[0:4], 'big', signed=False)
-                y = int.from_bytes(data[4:8], 'big', signed=False)
-                # Don't know what data[8:16] is for, but it's variable
-                rest = data[8:16]
-                yield f'Icon location: x {x}px, y {y}px, {show_one(rest)}'
-            elif field == 'LSVO':
-                self.validate_type(field, data, bool)
-                yield f'{field} (unknown): {data}'
-            elif field == 'bwsp':
-                self.validate_type(field, data, bytes)
-                yield 'Layout property list:'
-                yield from show(plistlib.loads(data), tab_depth=1)
-            elif field == 'cmmt':
-                self.validate_type(field, data, str)
-                yield f'Comments: {data}'
-            elif field == 'dilc':
-                self.validate_type(field, data, bytes, 32)
-                x = int.from_bytes(data[16:20], 'big', signed=False)
-                y = int.from_bytes(data[20:24], 'big', signed=False)
-                # They appear to be percentages with 0.001 accuracy
-                x /= 1000
-                y /= 1000
-                # Don't know what data[0:16] and data[24:32] are for
-                before = data[0:16]
-                after = data[24:32]
-                yield (f'Icon location on desktop: x {x}%, y {y}%'
-                       f', {show_one(before)}, {show_one(after)}')
-            elif field == 'dscl':
-                self.validate_type(field, data, bool)
-                yield f'Open in list view: {data}'
-            elif field == 'extn':
-                self.validate_type(field, data, str)
-                yield f'Extension: {data}'
-            elif field == 'fwi0':
-                # fwi0 somewhat supplanted by vstl, bwsp, lsvp, lsvP later
-                self.validate_type(field, data, bytes, 16)
-                yield 'Finder window information:'
-                top = int.from_bytes(data[0:2], 'big', signed=False)
-                left = int.from_bytes(data[2:4], 'big', signed=False)
-                bottom = int.from_bytes(data[4:6], 'big', signed=False)
-                right = int.from_bytes(data[6:8], 'big', signed=False)
-                yield (f'\tWindow rectangle: top {top}, left {left}, bottom'
-                       f' {bottom}, right {right}')
-                # Coverflow view not in Mojave now
-                # Similarly there's no Gallery view back then
-                views = {'icnv': 'Icon view',
-                         'clmv': 'Column view',
-                         'Nlsv': 'List view',
-                         'Flwv': 'Coverflow view'}
-                view_raw = data[8:12].decode('ascii')
-                view = views.get(view_raw, f'(unrecognized) {view_raw}')
-                yield f'View style (might be overtaken): {view}'
-                # Don't know what data[12:16] is for
-                yield f'{show_one(data[12:16])}'
-            elif field == 'fwsw':
-                self.validate_type(field, data, int)
-                yield f'Finder window sidebar width: {data}'
-            elif field == 'fwvh':
-                self.validate_type(field, data, int)
-                yield ('Finder window vertical height (overrides Finder window'
-                       f' information): {data}')
-            elif field == 'icgo':
-                self.validate_type(field, data, bytes, 8)
-                yield f'{field} (unknown): {show_one(data)}'
-            elif field == 'icsp':
-                self.validate_type(field, data, bytes, 8)
-                yield f'{field} (unknown): {show_one(data)}'
-            elif field == 'icvo':
-                # icvo supplanted by icvp in later versions
-                self.validate_type(field, data, bytes)
-                yield 'Icon view options:'
-                icvo_type = data[0:4].decode('ascii')
-                arranges = {'none': 'None', 'grid': 'Snap to Grid'}
-                labels = {'botm': 'Bottom', 'rght': 'Right'}
-                if icvo_type == 'icvo':
-                    self.validate_type(field, data, bytes, 18)
-                    flags = data[4:12]
-                    size = int.from_bytes(data[12:14], 'big', signed=False)
-                    arrange_raw = data[14:18].decode('ascii')
-                    arrange = arranges.get(arrange_raw,
-                                           f'(unknown) {arrange_raw}')
-                    yield f'\tFlags (?): {show_one(flags)}'
-                    yield f'\tSize: {size}px'
-                    yield f'\tKeep arranged by: {arrange}'
-                elif icvo_type == 'icv4':
-                    self.validate_type(field, data, bytes, 26)
-                    size = int.from_bytes(data[4:6], 'big', signed=False)
-                    arrange_raw = data[6:10].decode('ascii')
-                    arrange = arranges.get(arrange_raw,
-                                           f'(unknown) {arrange_raw}')
-                    label_raw = data[10:14].decode('ascii')
-                    label = labels.get(label_raw, f'(unknown) {label_raw}')
-                    flags = data[14:26]
-                    info = bool(flags[1] & 0x01)
-                    preview = bool(flags[11] & 0x01)
-                    yield f'\tSize: {size}px'
-                    yield f'\tKeep arranged by: {arrange}'
-                    yield f'\tLabel position: {label}'
-                    yield '\tFlags (partially known):'
-                    yield f'\t\tRaw flags: {show_one(flags)}'
-                    yield f'\t\tShow item info: {info}'
-                    yield f'\t\tShow icon preview: {preview}'
-                else:
-                    warnings.warn('Unrecognized icon view options type'
-                                  f' {icvo_type}')
-                    yield f'\t(unrecognized): {show_one(data)}'
-            elif field == 'icvp':
-                self.validate_type(field, data, bytes)
-                yield 'Icon view property list:'
-                yield from show(plistlib.loads(data), tab_depth=1)
-            elif field == 'info':
-                self.validate_type(field, data, bytes)
-                yield f'{field} (unknown): {show_one(data)}'
-            elif field in {'logS', 'lg1S'}:
-                # logS supplanted by lg1S for unknown reasons
-                self.validate_type(field, data, int)
-                yield f'Logical size: {data}B'
-            elif field == 'lssp':
-                self.validate_type(field, data, bytes, 8)
-                yield (f'{field} (unknown, List view scroll position?):'
-                       f' {show_one(data)}')
-            elif field == 'lsvC':
-                self.validate_type(field, data, bytes)
-                yield 'List view properties, alternative:'
-                yield from show(plistlib.loads(data), tab_depth=1)
-            elif field == 'lsvP':
-                self.validate_type(field, data, bytes)
-                yield 'List view properties, other alternative:'
-                yield from show(plistlib.loads(data), tab_depth=1)
-            elif field == 'lsvo':
-                # lsvo supplanted by lsvp / lsvP
-                self.validate_type(field, data, bytes, 76)
-                yield f'List view options (format unknown): {show_one(data)}'
-            elif field == 'lsvp':
-                self.validate_type(field, data, bytes)
-                yield 'List view properties:'
-                yield from show(plistlib.loads(data), tab_depth=1)
-            elif field == 'lsvt':
-                # lsvt supplanted by lsvp / lsvP
-                self.validate_type(field, data, int)
-                yield f'List view text size: {data}pt'
-            # Following 2 may appear at the same time, but difference unknown
-            # They were originally dutc, but now they use blob
-            # When dutc, it's the number of 1 / 65536 seconds from 1904
-            # Otherwise, it's TODO
-            elif field == 'moDD':
-                self.validate_type(field, data, (int, bytes))
-                if isinstance(data, int):
-                    date = data / 65536
-                    yield f'Modification date: {show_date(date)}'
-                elif isinstance(data, bytes):
-                    # Little endian for some reason
-                    date = int.from_bytes(data, 'little')
-                    yield ('Modification date (timestamp, format unknown:'
-                           f' {date}')
-            elif field == 'modD':
-                self.validate_type(field, data, (int, bytes))
-                if isinstance(data, int):
-                    date = data / 65536
-                    yield f'Modification date, alternative: {show_date(date)}'
-                elif isinstance(data, bytes):
-                    # Little endian for some reason
-                    date = int.from_bytes(data, 'little')
-                    yield ('Modification date, alternative (timestamp, format'
-                           f' unknown): {date}')
-            elif field in {'ph1S', 'phyS'}:
-                # phyS supplanted by ph1S for unknown reasons
-                self.validate_type(field, data, int)
-                yield f'Physical size: {data}B'
-            elif field == 'pict':
-                # pict, with BKGD, supplanted by TODO in later versions
-                # pict in format of Apple Finder alias
-                yield f'Picture: {show_one(data)}'
-            elif field == 'vSrn':
-                self.validate_type(field, data, int)
-                yield f'{field} (unknown): {data}'
-            elif field == 'vstl':
-                self.validate_type(field, data, str)
-                # Coverflow view not in Mojave now
-                # Similarly there's no Gallery view back then
-                views = {'icnv': 'Icon view',
-                         'clmv': 'Column view',
-                         'glyv': 'Gallery view',
-                         'Nlsv': 'List view',
-                         'Flwv': 'Coverflow view'}
-                view = views.get(data, f'(unrecognized) {data}')
-                yield f'View style: {view}'
-            else:
-                yield f'{field} (unrecognized): {data!r}'
+            handler = _FIELD_HANDLERS.get(field, _show_unrecognized)
+            yield from handler(self, field, data)
+
+
+# Field handlers for Record.human_readable
+# Each takes the record, the field name, and the data of the field, and yields
+# the lines describing the field
+
+
+def _show_unrecognized(record, field, data):
+    yield f'{field} (unrecognized): {data!r}'
+
+
+def _show_unknown(data_type, *acceptable_lengths):
+    def handler(record, field, data):
+        record.validate_type(field, data, data_type, *acceptable_lengths)
+        yield from show_titled(f'{field} (unknown)', data)
+    return handler
+
+
+def _show_plist(title):
+    def handler(record, field, data):
+        record.validate_type(field, data, bytes)
+        yield f'{title}:'
+        yield from show(record.load_plist(field, data), tab_depth=1)
+    return handler
+
+
+# Descriptions of the 4-byte tags inside blobs, keyed by the raw bytes so that
+# they're only decoded when unrecognized
+
+# Coverflow view not in Mojave now
+# Similarly there's no Gallery view back then
+_FWI0_VIEWS = {b'icnv': 'Icon view',
+               b'clmv': 'Column view',
+               b'Nlsv': 'List view',
+               b'Flwv': 'Coverflow view'}
+_ICVO_ARRANGES = {b'none': 'None', b'grid': 'Snap to Grid'}
+_ICVO_LABELS = {b'botm': 'Bottom', b'rght': 'Right'}
+
+
+def _describe_tag(descriptions, raw, unrecognized):
+    description = descriptions.get(raw)
+    if description is None:
+        description = f'{unrecognized} {raw.decode("ascii")}'
+    return description
+
+
+def _show_bkgd(record, field, data):
+    # BKGD supplanted by TODO in later versions
+    record.validate_type(field, data, bytes, 12)
+    background_type = data[:4]
+    if background_type == b'DefB':
+        yield 'Background: Default'
+    elif background_type == b'ClrB':
+        hex_color = data[4:10].hex()
+        yield f'Background: Color #{hex_color}'
+    elif background_type == b'PctB':
+        yield f'Background: Picture, see "Picture" field'
+    else:
+        warnings.warn('Unrecognized background type'
+                      f' {background_type.decode("ascii")}')
+        yield f'Background (unrecognized): {show_hex(data)}'
+
+
+def _show_iloc(record, field, data):
+    record.validate_type(field, data, bytes, 16)
+    x, y = _UINT32_PAIR.unpack_from(data, 0)
+    # Don't know what data[8:16] is for, but it's variable
+    rest = data[8:16]
+    yield f'Icon location: x {x}px, y {y}px, {show_hex(rest)}'
+
+
+def _show_cmmt(record, field, data):
+    record.validate_type(field, data, str)
+    yield f'Comments: {data}'
+
+
+def _show_dilc(record, field, data):
+    record.validate_type(field, data, bytes, 32)
+    x, y = _UINT32_PAIR.unpack_from(data, 16)
+    # They appear to be percentages with 0.001 accuracy
+    x /= 1000
+    y /= 1000
+    # Don't know what data[0:16] and data[24:32] are for
+    before = data[0:16]
+    after = data[24:32]
+    yield (f'Icon location on desktop: x {x}%, y {y}%'
+           f', {show_hex(before)}, {show_hex(after)}')
+
+
+def _show_dscl(record, field, data):
+    record.validate_type(field, data, bool)
+    yield f'Open in list view: {data}'
+
+
+def _show_extn(record, field, data):
+    record.validate_type(field, data, str)
+    yield f'Extension: {data}'
+
+
+def _show_fwi0(record, field, data):
+    # fwi0 somewhat supplanted by vstl, bwsp, lsvp, lsvP later
+    record.validate_type(field, data, bytes, 16)
+    yield 'Finder window information:'
+    top, left, bottom, right = _UINT16_QUAD.unpack_from(data, 0)
+    yield (f'\tWindow rectangle: top {top}, left {left}, bottom'
+           f' {bottom}, right {right}')
+    view = _describe_tag(_FWI0_VIEWS, data[8:12], '(unrecognized)')
+    yield f'View style (might be overtaken): {view}'
+    # Don't know what data[12:16] is for
+    yield show_hex(data[12:16])
+
+
+def _show_fwsw(record, field, data):
+    record.validate_type(field, data, int)
+    yield f'Finder window sidebar width: {data}'
+
+
+def _show_fwvh(record, field, data):
+    record.validate_type(field, data, int)
+    yield ('Finder window vertical height (overrides Finder window'
+           f' information): {data}')
+
+
+def _show_icvo(record, field, data):
+    # icvo supplanted by icvp in later versions
+    record.validate_type(field, data, bytes)
+    yield 'Icon view options:'
+    icvo_type = data[0:4]
+    if icvo_type == b'icvo':
+        record.validate_type(field, data, bytes, 18)
+        flags = data[4:12]
+        size, = _UINT16.unpack_from(data, 12)
+        arrange = _describe_tag(_ICVO_ARRANGES, data[14:18], '(unknown)')
+        yield f'\tFlags (?): {show_hex(flags)}'
+        yield f'\tSize: {size}px'
+        yield f'\tKeep arranged by: {arrange}'
+    elif icvo_type == b'icv4':
+        record.validate_type(field, data, bytes, 26)
+        size, = _UINT16.unpack_from(data, 4)
+        arrange = _describe_tag(_ICVO_ARRANGES, data[6:10], '(unknown)')
+        label = _describe_tag(_ICVO_LABELS, data[10:14], '(unknown)')
+        flags = data[14:26]
+        info = bool(flags[1] & 0x01)
+        preview = bool(flags[11] & 0x01)
+        yield f'\tSize: {size}px'
+        yield f'\tKeep arranged by: {arrange}'
+        yield f'\tLabel position: {label}'
+        yield '\tFlags (partially known):'
+        yield f'\t\tRaw flags: {show_hex(flags)}'
+        yield f'\t\tShow item info: {info}'
+        yield f'\t\tShow icon preview: {preview}'
+    else:
+        warnings.warn('Unrecognized icon view options type'
+                      f' {icvo_type.decode("ascii")}')
+        yield f'\t(unrecognized): {show_one(data)}'
+
+
+def _show_logical_size(record, field, data):
+    # logS supplanted by lg1S for unknown reasons
+    record.validate_type(field, data, int)
+    yield f'Logical size: {data}B'
+
+
+def _show_lssp(record, field, data):
+    record.validate_type(field, data, bytes, 8)
+    yield (f'{field} (unknown, List view scroll position?):'
+           f' {show_hex(data)}')
+
+
+def _show_lsvo(record, field, data):
+    # lsvo supplanted by lsvp / lsvP
+    record.validate_type(field, data, bytes, 76)
+    yield f'List view options (format unknown): {show_hex(data)}'
+
+
+def _show_lsvt(record, field, data):
+    # lsvt supplanted by lsvp / lsvP
+    record.validate_type(field, data, int)
+    yield f'List view text size: {data}pt'
+
+
+# Following 2 may appear at the same time, but difference unknown
+# They were originally dutc, but now they use blob
+# When dutc, it's the number of 1 / 65536 seconds from 1904
+# Otherwise, it's TODO
+_MODIFICATION_DATE_TITLES = {'moDD': 'Modification date',
+                             'modD': 'Modification date, alternative'}
+
+
+def _show_modification_date(record, field, data):
+    record.validate_type(field, data, (int, bytes))
+    title = _MODIFICATION_DATE_TITLES[field]
+    if isinstance(data, int):
+        date = data / 65536
+        yield f'{title}: {show_date(date)}'
+    elif isinstance(data, bytes):
+        # Little endian for some reason
+        date = int.from_bytes(data, 'little')
+        yield f'{title} (timestamp, format unknown): {date}'
+
+
+def _show_physical_size(record, field, data):
+    # phyS supplanted by ph1S for unknown reasons
+    record.validate_type(field, data, int)
+    yield f'Physical size: {data}B'
+
+
+def _show_pict(record, field, data):
+    # pict, with BKGD, supplanted by TODO in later versions
+    # pict in format of Apple Finder alias
+    yield from show_titled('Picture', data)
+
+
+def _show_vstl(record, field, data):
+    record.validate_type(field, data, str)
+    # Coverflow view not in Mojave now
+    # Similarly there's no Gallery view back then
+    views = {'icnv': 'Icon view',
+             'clmv': 'Column view',
+             'glyv': 'Gallery view',
+             'Nlsv': 'List view',
+             'Flwv': 'Coverflow view'}
+    view = views.get(data, f'(unrecognized) {data}')
+    yield f'View style: {view}'
+
+
+_FIELD_HANDLERS = {
+    'BKGD': _show_bkgd,
+    'GRP0': _show_unknown(str),
+    'ICVO': _show_unknown(bool),
+    'Iloc': _show_iloc,
+    'LSVO': _show_unknown(bool),
+    'bwsp': _show_plist('Layout property list'),
+    'cmmt': _show_cmmt,
+    'dilc': _show_dilc,
+    'dscl': _show_dscl,
+    'extn': _show_extn,
+    'fwi0': _show_fwi0,
+    'fwsw': _show_fwsw,
+    'fwvh': _show_fwvh,
+    'icgo': _show_unknown(bytes, 8),
+    'icsp': _show_unknown(bytes, 8),
+    'icvo': _show_icvo,
+    'icvp': _show_plist('Icon view property list'),
+    'info': _show_unknown(bytes),
+    'lg1S': _show_logical_size,
+    'logS': _show_logical_size,
+    'lssp': _show_lssp,
+    'lsvC': _show_plist('List view properties, alternative'),
+    'lsvP': _show_plist('List view properties, other alternative'),
+    'lsvo': _show_lsvo,
+    'lsvp': _show_plist('List view properties'),
+    'lsvt': _show_lsvt,
+    'moDD': _show_modification_date,
+    'modD': _show_modification_date,
+    'ph1S': _show_physical_size,
+    'phyS': _show_physical_size,
+    'pict': _show_pict,
+    'vSrn': _show_unknown(int),
+    'vstl': _show_vstl,
+}
 
 
 class DSStore:
 
     def __init__(self, content):
         self.cursor = 0
-        self.content = content
+        # Slicing a memoryview doesn't copy
+        self.content = memoryview(content)
         self.records = []
+        # Index of self.records by name, for merging fields of the same file
+        self._records_by_name = {}
         self.parse()
 
     def read(self):
         return self.records
 
+    def human_readable(self):
+        for record in self.records:
+            yield record.name
+            for description in record.human_readable():
+                yield f'\t{description}'
+
     def next_byte(self):
-        data = content[self.cursor]
+        data = self.content[self.cursor]
         self.cursor += 1
         return data
 
     def next_bytes(self, n):
-        data = content[self.cursor:self.cursor + n]
+        data = bytes(self.content[self.cursor:self.cursor + n])
         self.cursor += n
         return data
 
+    def next_str(self, n, encoding):
+        # Decodes straight from the memoryview, without copying to bytes first
+        data = str(self.content[self.cursor:self.cursor + n], encoding)
+        self.cursor += n
+        return data
+
+    def next_utf16(self, length):
+        # length is in UTF-16 code units
+        end = self.cursor + 2 * length
+        data, _ = _decode_utf16be(self.content[self.cursor:end], None, True)
+        self.cursor = end
+        return data
+
+    def next_tag(self):
+        raw = bytes(self.content[self.cursor:self.cursor + 4])
+        self.cursor += 4
+        tag = _TAGS.get(raw)
+        if tag is None:
+            # Interned, so comparing or hashing against literals is quick
+            tag = _TAGS[raw] = sys.intern(raw.decode('ascii'))
+        return tag
+
     def next_uint32(self):
-        data = int.from_bytes(self.next_bytes(4), 'big', signed=False)
+        data, = _UINT32.unpack_from(self.content, self.cursor)
+        self.cursor += 4
         return data
 
     def next_uint64(self):
-        data = int.from_bytes(self.next_bytes(8), 'big', signed=False)
+        data, = _UINT64.unpack_from(self.content, self.cursor)
+        self.cursor += 8
         return data
 
     def parse_header(self):
@@ -375,7 +530,7 @@ class DSStore:
         if second != 0:
             warnings.warn(f'Second int of allocator {hex(second)}'
                           ' not 0x00000000')
-        self.offsets = [self.next_uint32() for _ in range(num_offsets)]
+        self.offsets = self.next_uint32s(num_offsets)
 
         self.cursor = self.allocator_offset + 0x408
 
@@ -384,7 +539,7 @@ class DSStore:
         num_keys = self.next_uint32()
         for _ in range(num_keys):
             key_length = self.next_byte()
-            key = self.next_bytes(key_length).decode('ascii')
+            key = self.next_str(key_length, 'ascii')
             self.directory[key] = self.next_uint32()
             if key != 'DSDB':
                 warnings.warn(f"Directory contains non-'DSDB' key {key!r} and"
@@ -395,84 +550,140 @@ class DSStore:
             raise ValueError("Key 'DSDB' not found in table of contents")
         self.master_id = self.directory['DSDB']
 
-        # Free list
-        self.freelist = {}
-        for i in range(32):
-            values_length = self.next_uint32()
-            self.freelist[1 << i] = [self.next_uint32()
-                                     for _ in range(values_length)]
-
-    def parse_tree(self, *, node_id=None):
+        # Free list follows, but isn't needed for reading, so it's only parsed
+        # when accessed
+        self._freelist_offset = self.cursor
+        self._freelist = None
+
+    @property
+    def freelist(self):
+        if self._freelist is None:
+            cursor = self.cursor
+            self.cursor = self._freelist_offset
+            freelist = {}
+            for i in range(32):
+                values_length = self.next_uint32()
+                freelist[1 << i] = self.next_uint32s(values_length)
+            self.cursor = cursor
+            self._freelist = freelist
+        return self._freelist
+
+    def seek_node(self, node_id):
+        # The low 5 bits are the log2 of the block size, the rest the offset
+        self.cursor = 0x4 + (self.offsets[node_id] & ~0x1f)
+
+    def parse_tree(self):
         # The master node points to the root node and contains metadata
         # The B-tree contains nodes, which contain records of file properties
         # or nodes
-        if node_id is None:
-            master = True
-            node_id = self.master_id
-        else:
-            master = False
-
-        offset_and_size = self.offsets[node_id]
-        self.cursor = 0x4 + (offset_and_size >> 0x5 << 0x5)
-        # node size is 1 << (offset_and_size & 0x1f) TODO VALIDATE
-
-        if master:
-            # Master node
-            self.root_id = self.next_uint32()
-            self.tree_height = self.next_uint32()
-            self.num_records = self.next_uint32()
-            self.num_nodes = self.next_uint32()
-            fifth = self.next_uint32()  # TODO: tree node page size?
-            if fifth != 0x00001000:
-                warnings.warn(f'Fifth int of master {hex(fifth)}'
-                              ' not 0x00001000')
-            self.parse_tree(node_id=self.root_id)
-        else:
+
+        # Master node
+        self.seek_node(self.master_id)
+        self.root_id = self.next_uint32()
+        self.tree_height = self.next_uint32()
+        self.num_records = self.next_uint32()
+        self.num_nodes = self.next_uint32()
+        # Tree node page size, the same for all nodes
+        self.page_size = self.next_uint32()
+        if self.page_size != 0x00001000:
+            warnings.warn(f'Page size of master {hex(self.page_size)}'
+                          ' not 0x00001000')
+
+        # Walk the B-tree in order without recursion
+        # The stack holds node IDs still to be parsed, and (name, field, data)
+        # records of internal nodes waiting for their left children
+        stack = [self.root_id]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, tuple):
+                self.add_record(*item)
+                continue
+
+            self.seek_node(item)
             next_id = self.next_uint32()
             num_records = self.next_uint32()
-            for _ in range(num_records):
-                if next_id:
-                    # Has children
-                    child_id = self.next_uint32()
-                    current_cursor = self.cursor
-                    self.parse_tree(node_id=child_id)
-                    self.cursor = current_cursor
-
-                name_length = self.next_uint32()
-                name = self.next_bytes(name_length * 2).decode('utf-16be')
-                field = self.next_bytes(4).decode('ascii')
-                data = self.parse_data()
-                for record in self.records:
-                    if record.name == name:
-                        record.update({field: data})
-                        break
-                else:
-                    self.records.append(Record(name, {field: data}))
-
             if next_id:
-                self.parse_tree(node_id=next_id)
+                # Has children, so each record comes after its child, and
+                # next_id is the rightmost child
+                pending = []
+                for _ in range(num_records):
+                    pending.append(self.next_uint32())
+                    pending.append(self.parse_record())
+                pending.append(next_id)
+                stack.extend(reversed(pending))
+            else:
+                self.parse_leaf(num_records)
+
+    def parse_record(self):
+        name_length = self.next_uint32()
+        name = self.next_utf16(name_length)
+        field = self.next_tag()
+        data = self.parse_data()
+        return name, field, data
+
+    def parse_leaf(self, num_records):
+        # Same as calling parse_record for each record, but most records are
+        # in leaf nodes, so the lookups are hoisted and the name read inline
+        content = self.content
+        unpack_uint32 = _UINT32.unpack_from
+        decode_utf16be = _decode_utf16be
+        next_tag = self.next_tag
+        parse_data = self.parse_data
+        add_record = self.add_record
+        for _ in range(num_records):
+            cursor = self.cursor
+            name_length, = unpack_uint32(content, cursor)
+            cursor += 4
+            name_end = cursor + name_length * 2
+            name, _ = decode_utf16be(content[cursor:name_end], None, True)
+            self.cursor = name_end
+            field = next_tag()
+            add_record(name, field, parse_data())
+
+    def add_record(self, name, field, data):
+        record = self._records_by_name.get(name)
+        if record is None:
+            record = Record(name, {field: data})
+            self._records_by_name[name] = record
+            self.records.append(record)
+        else:
+            record.fields[field] = data
+
+    def next_uint32s(self, n):
+        data = list(struct.unpack_from(f'>{n}I', self.content, self.cursor))
+        self.cursor += 4 * n
+        return data
+
+    def next_bool(self):
+        return bool(self.next_byte() & 0x01)
+
+    def next_blob(self):
+        data_length = self.next_uint32()
+        return self.next_bytes(data_length)
+
+    def next_ustr(self):
+        data_length = self.next_uint32()
+        return self.next_utf16(data_length)
+
+    # Readers for the different .DS_Store data types
+    _DATA_READERS = {
+        'bool': next_bool,
+        # short is also 4, with 2 0x00 bytes padding, for some reason
+        'shor': next_uint32,
+        'long': next_uint32,
+        'comp': next_uint64,
+        'dutc': next_uint64,
+        'type': next_tag,
+        'blob': next_blob,
+        'ustr': next_ustr,
+    }
 
     def parse_data(self):
-        data_type = self.next_bytes(4).decode('ascii')
-        if data_type == 'bool':
-            return bool(self.next_byte() & 0x01)
-        elif data_type in {'shor', 'long'}:
-            # short is also 4, with 2 0x00 bytes padding, for some reason
-            return self.next_uint32()
-        elif data_type == 'comp':
-            return self.next_uint64()
-        elif data_type == 'dutc':
-            return self.next_uint64()
-        elif data_type == 'type':
-            return self.next_bytes(4).decode('ascii')
-        elif data_type == 'blob':
-            data_length = self.next_uint32()
-            return self.next_bytes(data_length)
-        elif data_type == 'ustr':
-            data_length = self.next_uint32()
-            return self.next_bytes(2 * data_length).decode('utf-16be')
-        else:
+        data_type = self.next_tag()
+        reader = self._DATA_READERS.get(data_type)
+        if reader is None:
             raise NotImplementedError(f'Unrecognized data type {data_type}')
+        return reader(self)
 
     def parse(self):
         self.parse_header()
@@ -493,7 +704,12 @@ if __name__ == '__main__':
     with open(filename, 'rb') as file:
         content = file.read()
     ds_store = DSStore(content)
+    # One write per record rather than a print per line, since stdout may be
+    # line buffered
+    write = sys.stdout.write
     for record in ds_store.read():
-        print(record.name)
-        for description in record.human_readable():
-            print(f'\t{description}')
+        lines = [record.name]
+        lines.extend(f'\t{description}'
+                     for description in record.human_readable())
+        lines.append('')
+        write('\n'.join(lines))